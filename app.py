@@ -7,16 +7,14 @@ Date: September 30, 2024
 
 import sys
 import asyncio
+import gzip
 from aiohttp import web, WSMsgType
 import json
-from json import JSONEncoder
-import numpy as np
 import uuid
 import logging
 import os
 import signal
 from typing import Dict, Any, List, Optional
-import base64
 import io
 
 from PIL import Image
@@ -41,27 +39,49 @@ def SIGSEGV_signal_arises(signalNum, stack):
 signal.signal(signal.SIGSEGV, SIGSEGV_signal_arises)
 
 from loader import initialize_models
-from engine import Engine, base64_data_uri_to_PIL_Image
+from engine import Engine
 
 # Global constants
 DATA_ROOT = os.environ.get('DATA_ROOT', '/tmp/data')
 MODELS_DIR = os.path.join(DATA_ROOT, "models")
 
-class NumpyEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, np.integer):
-            return int(obj)
-        elif isinstance(obj, np.floating):
-            return float(obj)
-        elif isinstance(obj, np.ndarray):
-            return obj.tolist()
-        else:
-            return super(NumpyEncoder, self).default(obj)
+# Maximum size of an uploaded image
+MAX_MESSAGE_SIZE = 16 * 1024 * 1024
+
+async def transform_worker(ws: web.WebSocketResponse, engine: Engine, queue: asyncio.Queue) -> None:
+    """Process the transform requests of a WebSocket connection, skipping the outdated ones"""
+    while True:
+        data = await queue.get()
+
+        # let the connection enqueue the messages it has already received
+        await asyncio.sleep(0)
+
+        # when the client sends requests faster than we can process them,
+        # only the most recent params of each image are worth rendering
+        # (websocket_handler only enqueues objects with a string uuid)
+        pending = {data['uuid']: data}
+        while not queue.empty():
+            data = queue.get_nowait()
+            pending.pop(data['uuid'], None)
+            pending[data['uuid']] = data
+
+        for uid, data in pending.items():
+            try:
+                image_bytes = await engine.transform_image(uid, data.get('params'))
+                await ws.send_bytes(image_bytes)
+            except Exception as e:
+                logger.error(f"Error in engine: {str(e)}")
+                logger.exception("Full traceback:")
+                if not ws.closed:
+                    await ws.send_json({"error": str(e)})
 
 async def websocket_handler(request: web.Request) -> web.WebSocketResponse:
-    ws = web.WebSocketResponse()
+    # the frames are already compressed (JPEG/WebP), deflating them again would only cost CPU time
+    ws = web.WebSocketResponse(compress=False, max_msg_size=MAX_MESSAGE_SIZE, heartbeat=20)
     await ws.prepare(request)
     engine = request.app['engine']
+    queue = asyncio.Queue()
+    worker = asyncio.create_task(transform_worker(ws, engine, queue))
     try:
         #logger.info("New WebSocket connection established")
         while True:
@@ -74,13 +94,14 @@ async def websocket_handler(request: web.Request) -> web.WebSocketResponse:
             try:
                 if msg.type == WSMsgType.BINARY:
                     res = await engine.load_image(msg.data)
-                    json_res = json.dumps(res, cls=NumpyEncoder)
-                    await ws.send_str(json_res)
+                    await ws.send_json(res)
 
                 elif msg.type == WSMsgType.TEXT:
                     data = json.loads(msg.data)
-                    webp_bytes = await engine.transform_image(data.get('uuid'), data.get('params'))
-                    await ws.send_bytes(webp_bytes)
+                    # the worker relies on the uuid to coalesce the requests, so malformed ones stop here
+                    if not isinstance(data, dict) or not isinstance(data.get('uuid'), str):
+                        raise ValueError("Invalid request: expected an object with a string uuid")
+                    queue.put_nowait(data)
 
             except Exception as e:
                 logger.error(f"Error in engine: {str(e)}")
@@ -90,22 +111,34 @@ async def websocket_handler(request: web.Request) -> web.WebSocketResponse:
     except Exception as e:
         logger.error(f"Error in websocket_handler: {str(e)}")
         logger.exception("Full traceback:")
+    finally:
+        worker.cancel()
     return ws
 
-async def index(request: web.Request) -> web.Response:
-    """Serve the index.html file"""
-    content = open(os.path.join(os.path.dirname(__file__), "public", "index.html"), "r").read()
-    return web.Response(content_type="text/html", text=content)
-
-async def js_index(request: web.Request) -> web.Response:
-    """Serve the index.js file"""
-    content = open(os.path.join(os.path.dirname(__file__), "public", "index.js"), "r").read()
-    return web.Response(content_type="application/javascript", text=content)
-
-async def hf_logo(request: web.Request) -> web.Response:
-    """Serve the hf-logo.svg file"""
-    content = open(os.path.join(os.path.dirname(__file__), "public", "hf-logo.svg"), "r").read()
-    return web.Response(content_type="image/svg+xml", text=content)
+# Files of the frontend, by route
+STATIC_FILES = {
+    "/": ("index.html", "text/html"),
+    "/index.js": ("index.js", "application/javascript"),
+    "/hf-logo.svg": ("hf-logo.svg", "image/svg+xml"),
+}
+
+def load_static_files() -> Dict[str, Any]:
+    """Read the frontend files once, along with their gzipped version"""
+    static_files = {}
+    for route, (filename, content_type) in STATIC_FILES.items():
+        with open(os.path.join(os.path.dirname(__file__), "public", filename), "rb") as f:
+            content = f.read()
+        static_files[route] = (content_type, content, gzip.compress(content, compresslevel=9))
+    return static_files
+
+async def static_file(request: web.Request) -> web.Response:
+    """Serve a frontend file, gzipped when the client accepts it"""
+    content_type, content, content_gz = request.app['static'][request.path]
+    headers = {"Cache-Control": "public, max-age=3600", "Vary": "Accept-Encoding"}
+    if "gzip" in request.headers.get("Accept-Encoding", ""):
+        headers["Content-Encoding"] = "gzip"
+        content = content_gz
+    return web.Response(body=content, content_type=content_type, headers=headers)
 
 async def initialize_app() -> web.Application:
     """Initialize and configure the web application."""
@@ -114,16 +147,19 @@ async def initialize_app() -> web.Application:
         live_portrait = await initialize_models()
 
         logger.info("🚀 Creating Engine instance...")
-        engine = Engine(live_portrait=live_portrait)
+        engine = Engine(
+            live_portrait=live_portrait,
+            interactive_encode=os.environ.get('INTERACTIVE_ENCODE', 'true').lower() != 'false'
+        )
         logger.info("✅ Engine instance created.")
 
-        app = web.Application()
+        app = web.Application(client_max_size=MAX_MESSAGE_SIZE)
         app['engine'] = engine
+        app['static'] = load_static_files()
 
         # Configure routes
-        app.router.add_get("/", index)
-        app.router.add_get("/index.js", js_index)
-        app.router.add_get("/hf-logo.svg", hf_logo)
+        for route in STATIC_FILES:
+            app.router.add_get(route, static_file)
         app.router.add_get("/ws", websocket_handler)
 
         logger.info("Application routes configured")
@@ -3,7 +3,7 @@ import { FiDownload } from 'react-icons/fi';
 import { PiImageSquare } from 'react-icons/pi';
 
 import { Alert, AlertDescription, AlertTitle } from '@/components/ui/alert';
-import { truncateFileName } from './lib/utils';
+import { getImageExtension, truncateFileName } from './lib/utils';
 import { useFaceLandmarkDetection } from './hooks/useFaceLandmarkDetection';
 import { About } from './components/About';
 import { Spinner } from './components/Spinner';
@@ -52,11 +52,12 @@ export function App() {
     setImageFile(files?.[0] || undefined)
   }, [setImageFile]);
 
-  const handleDownload = useCallback(() => {
+  const handleDownload = useCallback(async () => {
     if (previewImage) {
+      const blob = await fetch(previewImage).then(res => res.blob());
       const link = document.createElement('a');
       link.href = previewImage;
-      link.download = 'result.webp';
+      link.download = `result.${await getImageExtension(blob)}`;
       document.body.appendChild(link);
       link.click();
       document.body.removeChild(link);
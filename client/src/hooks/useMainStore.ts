@@ -86,7 +86,7 @@ export const useMainStore = create<ImageState>((set, get) => ({
         previewImage: image,
         originalImage: image,
       })
-      facePoke.loadImage(image);
+      facePoke.loadImage(file);
     } catch (err) {
       console.log(`failed to load the image: `, err);
       set({
@@ -99,7 +99,14 @@ export const useMainStore = create<ImageState>((set, get) => ({
   setIsGazingAtCursor: (isGazingAtCursor: boolean) => set({ isGazingAtCursor }),
   setOriginalImage: (url) => set({ originalImage: url }),
   setOriginalImageUuid: (originalImageUuid) => set({ originalImageUuid }),
-  setPreviewImage: (url) => set({ previewImage: url }),
+  setPreviewImage: (url) => {
+    const { previewImage } = get()
+    // frames sent by the server are displayed through object URLs, which must be released
+    if (previewImage !== url && previewImage.startsWith('blob:')) {
+      URL.revokeObjectURL(previewImage)
+    }
+    set({ previewImage: url })
+  },
   resetImage: () => {
     const { originalImage } = get()
     if (originalImage) {
@@ -133,7 +140,7 @@ export const useMainStore = create<ImageState>((set, get) => ({
       // the part about the head is not done yet, so we do it all for now.
 
       //  --- old way: use it whole ---
-      const image = await convertImageToBase64(params.image);
+      const image = URL.createObjectURL(params.image);
 
       //  --- future way: try to only apply the head ---
       // const image = await applyModifiedHeadToCanvas(params.image);
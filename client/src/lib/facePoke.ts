@@ -128,13 +128,9 @@ export class FacePoke {
     this.emitEvent('cleanup');
   }
 
-  public async loadImage(image: string): Promise<void> {
-     // Extract the base64 part if it's a data URL
-    const base64Data = image.split(',')[1] || image;
-
-    const buffer = new Uint8Array(atob(base64Data).split('').map(char => char.charCodeAt(0)));
-    const blob = new Blob([buffer], { type: 'application/octet-binary' });
-    this.sendBlobMessage(await blob.arrayBuffer());
+  public async loadImage(image: Blob): Promise<void> {
+    // the raw file bytes are sent as a binary frame, no need to go through base64
+    this.sendBlobMessage(await image.arrayBuffer());
   }
 
   public transformImage(uuid: string, params: Partial<ImageModificationParams>): void {
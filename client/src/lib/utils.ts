@@ -13,3 +13,18 @@ export function truncateFileName(fileName: string, maxLength: number = 16) {
 
   return `${start}...${end}`;
 };
+
+// the frames sent over the websocket come without a MIME type,
+// so we fall back to sniffing the magic bytes (JPEG from the GPU path, WebP otherwise)
+export async function getImageExtension(blob: Blob): Promise<string> {
+  switch (blob.type) {
+    case 'image/jpeg': return 'jpg';
+    case 'image/png': return 'png';
+    case 'image/webp': return 'webp';
+  }
+
+  const bytes = new Uint8Array(await blob.slice(0, 12).arrayBuffer());
+  if (bytes[0] === 0xFF && bytes[1] === 0xD8) return 'jpg';
+  if (bytes[0] === 0x89 && bytes[1] === 0x50 && bytes[2] === 0x4E && bytes[3] === 0x47) return 'png';
+  return 'webp';
+}
@@ -1,23 +1,31 @@
-import uuid
+import secrets
 import logging
 import hashlib
 import os
 import io
 import asyncio
-from async_lru import alru_cache
-import base64
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from queue import Queue
 from typing import Dict, Any, List, Optional, Union
 from functools import lru_cache
 import numpy as np
+import cv2
 import torch
 import torch.nn.functional as F
+import torchvision
 from PIL import Image, ImageOps
 
+try:
+    # multithreaded SIMD hashing, several times faster than hashlib on large uploads
+    import blake3
+except ImportError:
+    blake3 = None
+
 from liveportrait.config.argument_config import ArgumentConfig
 from liveportrait.utils.camera import get_rotation_matrix
 from liveportrait.utils.io import resize_to_limit
-from liveportrait.utils.crop import prepare_paste_back, paste_back, parse_bbox_from_landmark
+from liveportrait.utils.crop import prepare_paste_back, paste_back_torch, get_affine_theta, parse_bbox_from_landmark
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -27,63 +35,384 @@ logger = logging.getLogger(__name__)
 DATA_ROOT = os.environ.get('DATA_ROOT', '/tmp/data')
 MODELS_DIR = os.path.join(DATA_ROOT, "models")
 
-def base64_data_uri_to_PIL_Image(base64_string: str) -> Image.Image:
+# Maximum number of uploaded images whose load_image() result is kept around,
+# each of them holds its features, keypoints and CUDA graph on the device
+IMAGE_CACHE_SIZE = 64
+
+# Maximum number of rotation matrices kept around, and their angular resolution (in steps per degree)
+ROTATION_CACHE_SIZE = 4096
+ROTATION_STEPS_PER_DEGREE = 4
+
+# Quality of the encoded output frames, while the user is moving the sliders or not
+INTERACTIVE_ENCODE_QUALITY = 82
+ENCODE_QUALITY = 95
+
+# Number of implicit keypoints of the LivePortrait motion extractor
+NUM_KEYPOINTS = 21
+
+# Adapted from https://github.com/PowerHouseMan/ComfyUI-AdvancedLivePortrait/blob/main/nodes.py#L408-L472
+# Each adjustment is (i, j, k, factor if param > 0, factor if param <= 0)
+_MODIFICATIONS = (
+    ('smile', (
+        (0, 20, 1, -0.01, -0.01), (0, 14, 1, -0.02, -0.02), (0, 17, 1, 0.0065, 0.0065), (0, 17, 2, 0.003, 0.003),
+        (0, 13, 1, -0.00275, -0.00275), (0, 16, 1, -0.00275, -0.00275), (0, 3, 1, -0.0035, -0.0035), (0, 7, 1, -0.0035, -0.0035)
+    )),
+    ('aaa', (
+        (0, 19, 1, 0.001, 0.001), (0, 19, 2, 0.0001, 0.0001), (0, 17, 1, -0.0001, -0.0001)
+    )),
+    ('eee', (
+        (0, 20, 2, -0.001, -0.001), (0, 20, 1, -0.001, -0.001), (0, 14, 1, -0.001, -0.001)
+    )),
+    ('woo', (
+        (0, 14, 1, 0.001, 0.001), (0, 3, 1, -0.0005, -0.0005), (0, 7, 1, -0.0005, -0.0005), (0, 17, 2, -0.0005, -0.0005)
+    )),
+    ('wink', (
+        (0, 11, 1, 0.001, 0.001), (0, 13, 1, -0.0003, -0.0003), (0, 17, 0, 0.0003, 0.0003),
+        (0, 17, 1, 0.0003, 0.0003), (0, 3, 1, -0.0003, -0.0003)
+    )),
+    ('pupil_x', (
+        (0, 11, 0, 0.0007, 0.001),
+        (0, 15, 0, 0.001, 0.0007)
+    )),
+    ('pupil_y', (
+        (0, 11, 1, -0.001, -0.001), (0, 15, 1, -0.001, -0.001),
+        # Special case for pupil_y affecting eyes
+        (0, 11, 1, -0.001, -0.001), (0, 15, 1, -0.001, -0.001)
+    )),
+    ('eyes', (
+        (0, 11, 1, -0.001, -0.001), (0, 13, 1, 0.0003, 0.0003), (0, 15, 1, -0.001, -0.001), (0, 16, 1, 0.0003, 0.0003),
+        (0, 1, 1, -0.00025, -0.00025), (0, 2, 1, 0.00025, 0.00025)
+    )),
+    ('eyebrow', (
+        (0, 1, 1, 0.001, 0.0003),
+        (0, 2, 1, -0.001, -0.0003),
+        (0, 1, 0, 0, -0.001),
+        (0, 2, 0, 0, 0.001)
+    )),
+    # Some other ones: https://github.com/jbilcke-hf/FacePoke/issues/22#issuecomment-2408708028
+    # Still need to check how exactly we would control those in the UI,
+    # as we don't have yet segmentation in the frontend UI for those body parts
+    #('lower_lip', (
+    #    (0, 19, 1, 0.02, 0.02),
+    #)),
+    #('upper_lip', (
+    #    (0, 20, 1, -0.01, -0.01),
+    #)),
+    #('neck', ((0, 5, 1, 0.01, 0.01),)),
+)
+
+# Params equal up to this number of decimals render the same image
+PARAMS_SIGNATURE_DECIMALS = 4
+
+def transform_keypoints(
+    kp: torch.Tensor,
+    p: torch.Tensor,
+    deltas: torch.Tensor,
+    R: torch.Tensor,
+    scale: torch.Tensor,
+    t: torch.Tensor,
+) -> torch.Tensor:
+    """
+    Apply the facial expression params, then the head pose, to the keypoints.
+
+    Args:
+        kp (torch.Tensor): The 1x21x3 keypoints of the source image.
+        p (torch.Tensor): The value of each param.
+        deltas (torch.Tensor): The 2xPx1x21x3 offset of the keypoints per unit of each param,
+            indexed by the sign of the param first (0 if <= 0, 1 if > 0).
+        R (torch.Tensor): The 1x3x3 rotation matrix.
+        scale (torch.Tensor): The scale of the source image.
+        t (torch.Tensor): The translation of the source image.
+
+    Returns:
+        torch.Tensor: The 1x21x3 driving keypoints.
+    """
+    # pick the deltas of the sign-dependent params without branching
+    deltas = torch.where(p.view(-1, 1, 1, 1) > 0, deltas[1], deltas[0])
+
+    kp = kp + torch.einsum('p,pijk->ijk', p, deltas)
+    return scale * (kp @ R) + t
+
+def get_image_hash(data: bytes) -> str:
+    """
+    Compute the content hash of an encoded image.
+
+    The hash is computed on the compressed bytes as they were uploaded,
+    so the image doesn't need to be decoded to be identified.
+
+    Args:
+        data (bytes): The encoded image data.
+
+    Returns:
+        str: The hexadecimal digest of the image.
+    """
+    if blake3 is None:
+        return hashlib.blake2b(data, digest_size=16).hexdigest()
+    return blake3.blake3(data, max_threads=blake3.blake3.AUTO).hexdigest(16)
+
+def decode_image(data: bytes) -> np.ndarray:
     """
-    Convert a base64 data URI to a PIL Image.
+    Decode an uploaded image into an RGB array.
+
+    Common formats (JPEG, PNG, WebP..) are decoded by torchvision straight from
+    the uploaded bytes, PIL is only used for the others (eg. AVIF).
 
     Args:
-        base64_string (str): The base64 encoded image data.
+        data (bytes): The encoded image data.
 
     Returns:
-        Image.Image: The decoded PIL Image.
+        np.ndarray: The HxWx3 uint8 image.
     """
-    if ',' in base64_string:
-        base64_string = base64_string.split(',')[1]
-    img_data = base64.b64decode(base64_string)
-    return Image.open(io.BytesIO(img_data))
+    try:
+        # keep the exif orientation (fix the selfie issue on iphone)
+        image = torchvision.io.decode_image(
+            torch.frombuffer(data, dtype=torch.uint8),
+            mode=torchvision.io.ImageReadMode.RGB,
+            apply_exif_orientation=True
+        )
+        # animated images are decoded as a batch of frames
+        if image.ndim == 4:
+            image = image[0]
+        # 16-bit PNGs are decoded as uint16, the rest of the pipeline expects 8-bit images
+        if image.dtype == torch.uint16:
+            image = (image.float() * (255 / 65535)).round().to(torch.uint8)
+        elif image.dtype != torch.uint8:
+            raise ValueError(f"Unexpected decoded image dtype: {image.dtype}")
+        return image.permute(1, 2, 0).contiguous().numpy()
+    except (RuntimeError, ValueError):
+        image = Image.open(io.BytesIO(data))
+
+        # keep the exif orientation (fix the selfie issue on iphone)
+        image = ImageOps.exif_transpose(image)
+
+        # Convert the image to RGB mode (removes alpha channel if present)
+        image = image.convert('RGB')
+
+        return np.array(image)
 
 class Engine:
     """
     The main engine class for FacePoke
     """
 
-    def __init__(self, live_portrait):
+    def __init__(self, live_portrait, interactive_encode: bool = True):
         """
         Initialize the FacePoke engine with necessary models and processors.
 
         Args:
             live_portrait (LivePortraitPipeline): The LivePortrait model for video generation.
+            interactive_encode (bool): Favor encoding latency over quality for the output frames.
         """
         self.live_portrait = live_portrait
+        self.encode_quality = INTERACTIVE_ENCODE_QUALITY if interactive_encode else ENCODE_QUALITY
 
         self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
-        self.processed_cache = {}  # Stores the processed image data
+        self.image_cache = OrderedDict()  # Maps the hash of an uploaded image to its load_image() result
+        self.processed_cache = {}  # Stores the processed image data, evicted along with image_cache
+        self.loading_images = {}  # Maps the hash of an image being loaded to its load task
+        self.rotation_cache = OrderedDict()  # Maps quantized (pitch, yaw, roll) angles to their rotation matrix
+
+        # nvJPEG is only reachable through torchvision when running on CUDA
+        self.gpu_encoding = self.device.type == "cuda"
+
+        # stitching and warp_decode are recorded once per image as a CUDA graph, then replayed for each request
+        self.use_cuda_graphs = self.device.type == "cuda"
+        self.graph_pool = torch.cuda.graph_pool_handle() if self.use_cuda_graphs else None
+
+        # transform requests are rendered one at a time, in a single thread dedicated to inference
+        self.infer_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="inference")
+
+        self._init_facial_modifications()
+
+        # the keypoints transform is a few dozen tiny ops, compiling fuses them into a couple of kernels
+        self.compiled_transform_keypoints = (
+            torch.compile(transform_keypoints, fullgraph=True, dynamic=False) if self.device.type == "cuda" else None
+        )
+        self._warmup_transform_keypoints()
 
         logger.info("✅ FacePoke Engine initialized successfully.")
 
-    @alru_cache(maxsize=512)
-    async def load_image(self, data):
-        image = Image.open(io.BytesIO(data))
+    def _init_facial_modifications(self):
+        """
+        Build the tensors used by transform_keypoints().
 
-        # keep the exif orientation (fix the selfie issue on iphone)
-        image = ImageOps.exif_transpose(image)
+        Every adjustment of the keypoints is a linear function of one of the params,
+        so each param is stored as the offset of all the keypoints per unit of its value.
+        Both signs of every param get their own offset, as some factors depend on the sign of the param.
+        """
+        self._param_names = [param_name for param_name, _ in _MODIFICATIONS]
 
-        # Convert the image to RGB mode (removes alpha channel if present)
-        image = image.convert('RGB')
+        # adjustments on the same keypoint coordinate are summed
+        deltas = torch.zeros(2, len(self._param_names), 1, NUM_KEYPOINTS, 3)
+        for p, (_, adjustments) in enumerate(_MODIFICATIONS):
+            for i, j, k, factor_pos, factor_neg in adjustments:
+                deltas[0, p, i, j, k] += factor_neg
+                deltas[1, p, i, j, k] += factor_pos
+
+        self._mod_deltas = deltas.to(self.device)
+
+        # the param values are staged in page-locked memory, so that their upload doesn't block the inference thread
+        pin_memory = self.device.type == "cuda"
+        self._params_host = torch.empty(len(self._param_names), dtype=torch.float32, pin_memory=pin_memory)
+        self._params_device = torch.empty(len(self._param_names), dtype=torch.float32, device=self.device)
 
-        uid = str(uuid.uuid4())
-        img_rgb = np.array(image)
+    def _transform_keypoints(self, processed_data: Dict[str, Any], params: Dict[str, float]) -> torch.Tensor:
+        """
+        Apply the facial expression params, then the head pose, to the keypoints of the source image.
+
+        Args:
+            processed_data (Dict[str, Any]): The processed data of the source image.
+            params (Dict[str, float]): The modification params.
+
+        Returns:
+            torch.Tensor: The 1x21x3 driving keypoints.
+        """
+        x_s_info = processed_data['x_s_info']
+
+        # the previous frame has been copied back to the host when it was encoded,
+        # so its upload is over and the staging buffer can be overwritten
+        self._params_host.numpy()[:] = [params.get(name, 0) for name in self._param_names]
+        p = self._params_device.copy_(self._params_host, non_blocking=True)
+
+        pitch, yaw, roll = processed_data['angles']
+        R_new = self._get_rotation_matrix(
+            pitch + params.get('rotate_pitch', 0),
+            yaw + params.get('rotate_yaw', 0),
+            roll + params.get('rotate_roll', 0)
+        )
+
+        args = (
+            x_s_info['kp'], p, self._mod_deltas,
+            R_new, x_s_info['scale'], x_s_info['t']
+        )
+
+        if self.compiled_transform_keypoints is not None:
+            try:
+                return self.compiled_transform_keypoints(*args)
+            except Exception as e:
+                logger.warning(f"Failed to compile the keypoints transform, running it eagerly: {str(e)}")
+                self.compiled_transform_keypoints = None
+
+        return transform_keypoints(*args)
+
+    @torch.inference_mode()
+    def _warmup_transform_keypoints(self):
+        """
+        Compile the keypoints transform now, rather than on the first request (which would block the inference thread).
+
+        The dummy inputs have the shapes, dtypes and strides of the real ones, so that the compiled code is reused as is
+        (the rotation matrix comes from the same path as for real requests, as it is a transposed view).
+        """
+        if self.compiled_transform_keypoints is None:
+            return
+
+        logger.info("⏳ Compiling the keypoints transform...")
+        try:
+            self.compiled_transform_keypoints(
+                torch.zeros(1, NUM_KEYPOINTS, 3, device=self.device),
+                self._params_device.zero_(),
+                self._mod_deltas,
+                self._get_rotation_matrix(0.0, 0.0, 0.0),
+                torch.ones(1, 1, device=self.device),
+                torch.zeros(1, 3, device=self.device)
+            )
+        except Exception as e:
+            logger.warning(f"Failed to compile the keypoints transform, running it eagerly: {str(e)}")
+            self.compiled_transform_keypoints = None
+
+    def _get_rotation_matrix(self, pitch: float, yaw: float, roll: float) -> torch.Tensor:
+        """
+        Get the rotation matrix of the given angles, reusing a cached one when possible.
+
+        Angles are quantized to 1/ROTATION_STEPS_PER_DEGREE of a degree,
+        so that small variations of the sliders reuse the same matrix.
+
+        Args:
+            pitch (float): The pitch, in degrees.
+            yaw (float): The yaw, in degrees.
+            roll (float): The roll, in degrees.
 
-        inference_cfg = self.live_portrait.live_portrait_wrapper.cfg
-        img_rgb = await asyncio.to_thread(resize_to_limit, img_rgb, inference_cfg.ref_max_shape, inference_cfg.ref_shape_n)
-        crop_info = await asyncio.to_thread(self.live_portrait.cropper.crop_single_image, img_rgb)
+        Returns:
+            torch.Tensor: The 1x3x3 rotation matrix.
+        """
+        key = tuple(round(angle * ROTATION_STEPS_PER_DEGREE) for angle in (pitch, yaw, roll))
+
+        R = self.rotation_cache.get(key)
+        if R is not None:
+            self.rotation_cache.move_to_end(key)
+            return R
+
+        angles = torch.tensor(key, dtype=torch.float32, device=self.device).view(3, 1, 1) / ROTATION_STEPS_PER_DEGREE
+        R = get_rotation_matrix(angles[0], angles[1], angles[2])
+
+        self.rotation_cache[key] = R
+        if len(self.rotation_cache) > ROTATION_CACHE_SIZE:
+            self.rotation_cache.popitem(last=False)
+
+        return R
+
+    def _to_device(self, array: np.ndarray) -> torch.Tensor:
+        """
+        Upload an array to the device, through page-locked memory when running on CUDA.
+
+        Args:
+            array (np.ndarray): The array to upload.
+
+        Returns:
+            torch.Tensor: The tensor on the device.
+        """
+        tensor = torch.from_numpy(array)
+        if self.device.type != "cuda":
+            return tensor
+
+        # the caching host allocator keeps the pinned copy alive until the transfer is over
+        return tensor.pin_memory().to(self.device, non_blocking=True)
+
+    @torch.inference_mode()
+    def _load_image_sync(self, data: bytes, image_hash: str) -> Dict[str, Any]:
+        """
+        Decode an uploaded image and prepare everything transform_image() needs to animate it.
+
+        This is the whole pipeline of load_image(), it runs in a worker thread.
+
+        Args:
+            data (bytes): The encoded image data.
+            image_hash (str): The content hash of the image.
+
+        Returns:
+            Dict[str, Any]: The processed data of the image.
+        """
+        img_rgb = decode_image(data)
+
+        wrapper = self.live_portrait.live_portrait_wrapper
+        inference_cfg = wrapper.cfg
+        img_rgb = resize_to_limit(img_rgb, inference_cfg.ref_max_shape, inference_cfg.ref_shape_n)
+        # on CUDA, the crop is downscaled to the network input size on the device
+        crop_device = self.device if self.device.type == "cuda" else None
+        crop_info = self.live_portrait.cropper.crop_single_image(img_rgb, device=crop_device)
         img_crop_256x256 = crop_info['img_crop_256x256']
 
-        I_s = await asyncio.to_thread(self.live_portrait.live_portrait_wrapper.prepare_source, img_crop_256x256)
-        x_s_info = await asyncio.to_thread(self.live_portrait.live_portrait_wrapper.get_kp_info, I_s)
-        f_s = await asyncio.to_thread(self.live_portrait.live_portrait_wrapper.extract_feature_3d, I_s)
-        x_s = await asyncio.to_thread(self.live_portrait.live_portrait_wrapper.transform_keypoint, x_s_info)
+        I_s = wrapper.prepare_source(img_crop_256x256)
+        x_s_info = wrapper.get_kp_info(I_s)
+        f_s = wrapper.extract_feature_3d(I_s)
+        x_s = wrapper.transform_keypoint(x_s_info)
+
+        # everything read by transform_image() is kept on the device, in the layout the networks expect,
+        # so that a request never triggers a copy (those are no-ops when the wrapper already did it)
+        # the feature volume is the largest of them, warp_decode runs under autocast anyway
+        # so it is stored in half precision, halving its footprint and the bytes read per frame
+        f_s_dtype = getattr(torch, inference_cfg.half_precision_dtype) if inference_cfg.flag_use_half_precision else torch.float32
+        f_s = f_s.to(self.device, f_s_dtype).contiguous()
+        x_s = x_s.to(self.device, torch.float32).contiguous()
+        for k in ('kp', 'scale', 't'):
+            x_s_info[k] = x_s_info[k].to(self.device, torch.float32).contiguous()
+
+        # the paste back mask only depends on the source image, so we prepare it once
+        mask_ori = prepare_paste_back(
+            inference_cfg.mask_crop, crop_info['M_c2o'],
+            dsize=(img_rgb.shape[1], img_rgb.shape[0])
+        )
 
         processed_data = {
             'img_rgb': img_rgb,
@@ -91,25 +420,71 @@ class Engine:
             'x_s_info': x_s_info,
             'f_s': f_s,
             'x_s': x_s,
-            'inference_cfg': inference_cfg
+            'inference_cfg': inference_cfg,
+            'image_hash': image_hash,
+            # the warp of the output into the source image only depends on the crop, so it is uploaded once
+            'paste_back_theta': self._to_device(get_affine_theta(
+                crop_info['M_c2o'],
+                (crop_info['img_crop'].shape[1], crop_info['img_crop'].shape[0]),
+                (img_rgb.shape[1], img_rgb.shape[0])
+            )),
+
+            # the channels of the mask are identical, so a single one is kept (in float16), the blend broadcasts it
+            'mask_ori': self._to_device(np.ascontiguousarray(mask_ori[:, :, 0], dtype=np.float16))[None, None],
+
+            # the source image the output is pasted back into, kept in uint8 to save device memory
+            'rgb_ori': self._to_device(img_rgb).permute(2, 0, 1).unsqueeze(0),
+
+            # the head pose of the source, in degrees
+            'angles': (x_s_info['pitch'].item(), x_s_info['yaw'].item(), x_s_info['roll'].item()),
         }
 
-        self.processed_cache[uid] = processed_data
+        return processed_data
+
+    async def load_image(self, data):
+        image_hash = get_image_hash(data)
+        if image_hash in self.image_cache:
+            self.image_cache.move_to_end(image_hash)
+            return self.image_cache[image_hash]
+
+        # concurrent uploads of the same image share a single load, so that each hash only ever has one uid
+        task = self.loading_images.get(image_hash)
+        if task is None:
+            task = asyncio.ensure_future(self._load_image(data, image_hash))
+            self.loading_images[image_hash] = task
+            task.add_done_callback(lambda _: self.loading_images.pop(image_hash, None))
+
+        # a client disconnecting must not cancel the load for the others
+        return await asyncio.shield(task)
+
+    async def _load_image(self, data: bytes, image_hash: str) -> Dict[str, Any]:
+        # the uid is the only handle on an uploaded image, so it must not be guessable (no counter)
+        uid = secrets.token_hex(8)
+        processed_data = await asyncio.to_thread(self._load_image_sync, data, image_hash)
 
         # Calculate the bounding box
         bbox_info = parse_bbox_from_landmark(processed_data['crop_info']['lmk_crop'], scale=1.0)
 
-        return {
+        # the numpy values are converted here, once per image, so that the result can be sent as plain JSON
+        result = {
             'u': uid,
-
-            # those aren't easy to serialize
-            'c': bbox_info['center'], # 2x1
-            's': bbox_info['size'], # scalar
-            'b': bbox_info['bbox'],  # 4x2
-            'a': bbox_info['angle'],  # rad, counterclockwise
+            'c': np.asarray(bbox_info['center']).tolist(), # 2x1
+            's': np.asarray(bbox_info['size']).tolist(), # scalar
+            'b': np.asarray(bbox_info['bbox']).tolist(),  # 4x2
+            'a': np.asarray(bbox_info['angle']).tolist(),  # rad, counterclockwise
             # 'bbox_rot': bbox_info['bbox_rot'].toList(),  # 4x2
         }
 
+        # both caches are filled together, so that the processed data is always evicted with its hash
+        self.processed_cache[uid] = processed_data
+        self.image_cache[image_hash] = result
+        if len(self.image_cache) > IMAGE_CACHE_SIZE:
+            # dropping the processed data releases its device memory (features, buffers, CUDA graph)
+            _, evicted = self.image_cache.popitem(last=False)
+            self.processed_cache.pop(evicted['u'], None)
+
+        return result
+
     async def transform_image(self, uid: str, params: Dict[str, float]) -> bytes:
         # If we don't have the image in cache yet, add it
         if uid not in self.processed_cache:
@@ -117,112 +492,149 @@ class Engine:
 
         processed_data = self.processed_cache[uid]
 
-        try:
-            # Apply modifications based on params
-            x_d_new = processed_data['x_s_info']['kp'].clone()
-
-            # Adapted from https://github.com/PowerHouseMan/ComfyUI-AdvancedLivePortrait/blob/main/nodes.py#L408-L472
-            modifications = [
-                ('smile', [
-                    (0, 20, 1, -0.01), (0, 14, 1, -0.02), (0, 17, 1, 0.0065), (0, 17, 2, 0.003),
-                    (0, 13, 1, -0.00275), (0, 16, 1, -0.00275), (0, 3, 1, -0.0035), (0, 7, 1, -0.0035)
-                ]),
-                ('aaa', [
-                    (0, 19, 1, 0.001), (0, 19, 2, 0.0001), (0, 17, 1, -0.0001)
-                ]),
-                ('eee', [
-                    (0, 20, 2, -0.001), (0, 20, 1, -0.001), (0, 14, 1, -0.001)
-                ]),
-                ('woo', [
-                    (0, 14, 1, 0.001), (0, 3, 1, -0.0005), (0, 7, 1, -0.0005), (0, 17, 2, -0.0005)
-                ]),
-                ('wink', [
-                    (0, 11, 1, 0.001), (0, 13, 1, -0.0003), (0, 17, 0, 0.0003),
-                    (0, 17, 1, 0.0003), (0, 3, 1, -0.0003)
-                ]),
-                ('pupil_x', [
-                    (0, 11, 0, 0.0007 if params.get('pupil_x', 0) > 0 else 0.001),
-                    (0, 15, 0, 0.001 if params.get('pupil_x', 0) > 0 else 0.0007)
-                ]),
-                ('pupil_y', [
-                    (0, 11, 1, -0.001), (0, 15, 1, -0.001)
-                ]),
-                ('eyes', [
-                    (0, 11, 1, -0.001), (0, 13, 1, 0.0003), (0, 15, 1, -0.001), (0, 16, 1, 0.0003),
-                    (0, 1, 1, -0.00025), (0, 2, 1, 0.00025)
-                ]),
-                ('eyebrow', [
-                    (0, 1, 1, 0.001 if params.get('eyebrow', 0) > 0 else 0.0003),
-                    (0, 2, 1, -0.001 if params.get('eyebrow', 0) > 0 else -0.0003),
-                    (0, 1, 0, -0.001 if params.get('eyebrow', 0) <= 0 else 0),
-                    (0, 2, 0, 0.001 if params.get('eyebrow', 0) <= 0 else 0)
-                ]),
-                # Some other ones: https://github.com/jbilcke-hf/FacePoke/issues/22#issuecomment-2408708028
-                # Still need to check how exactly we would control those in the UI,
-                # as we don't have yet segmentation in the frontend UI for those body parts
-                #('lower_lip', [
-                #    (0, 19, 1, 0.02)
-                #]),
-                #('upper_lip', [
-                #    (0, 20, 1, -0.01)
-                #]),
-                #('neck', [(0, 5, 1, 0.01)]),
-            ]
-
-            for param_name, adjustments in modifications:
-                param_value = params.get(param_name, 0)
-                for i, j, k, factor in adjustments:
-                    x_d_new[i, j, k] += param_value * factor
-
-            # Special case for pupil_y affecting eyes
-            x_d_new[0, 11, 1] -= params.get('pupil_y', 0) * 0.001
-            x_d_new[0, 15, 1] -= params.get('pupil_y', 0) * 0.001
-            params['eyes'] = params.get('eyes', 0) - params.get('pupil_y', 0) / 2.
-
-
-            # Apply rotation
-            R_new = get_rotation_matrix(
-                processed_data['x_s_info']['pitch'] + params.get('rotate_pitch', 0),
-                processed_data['x_s_info']['yaw'] + params.get('rotate_yaw', 0),
-                processed_data['x_s_info']['roll'] + params.get('rotate_roll', 0)
-            )
-            x_d_new = processed_data['x_s_info']['scale'] * (x_d_new @ R_new) + processed_data['x_s_info']['t']
-
-            # Apply stitching
-            x_d_new = await asyncio.to_thread(self.live_portrait.live_portrait_wrapper.stitching, processed_data['x_s'], x_d_new)
-
-            # Generate the output
-            out = await asyncio.to_thread(self.live_portrait.live_portrait_wrapper.warp_decode, processed_data['f_s'], processed_data['x_s'], x_d_new)
-            I_p = await asyncio.to_thread(self.live_portrait.live_portrait_wrapper.parse_output, out['out'])
-
-            buffered = io.BytesIO()
-
-            ####################################################
-            # this part is about stitching the image back into the original.
-            #
-            # this is an expensive operation, not just because of the compute
-            # but because the payload will also be bigger (we send back the whole pic)
-            #
-            # I'm currently running some experiments to do it in the frontend
-            #
-            #  --- old way: we do it in the server-side: ---
-            mask_ori = await asyncio.to_thread(prepare_paste_back,
-                processed_data['inference_cfg'].mask_crop, processed_data['crop_info']['M_c2o'],
-                dsize=(processed_data['img_rgb'].shape[1], processed_data['img_rgb'].shape[0])
-            )
-            I_p_to_ori_blend = await asyncio.to_thread(paste_back,
-                I_p[0], processed_data['crop_info']['M_c2o'], processed_data['img_rgb'], mask_ori
-            )
-            result_image = Image.fromarray(I_p_to_ori_blend)
-
-            # --- maybe future way: do it in the frontend: ---
-            #result_image = Image.fromarray(I_p[0])
-            ####################################################
+        # the images being transformed are the last to be evicted
+        self.image_cache.move_to_end(processed_data['image_hash'])
 
-            # write it into a webp
-            result_image.save(buffered, format="WebP", quality=82, lossless=False, method=6)
+        # sliders often send the same values again (or jitter below what is visible), re-rendering them is wasted work
+        signature = tuple(sorted((name, round(value, PARAMS_SIGNATURE_DECIMALS)) for name, value in params.items()))
+        last_signature, last_output = processed_data.get('last_output', (None, None))
+        if signature == last_signature:
+            return last_output
 
-            return buffered.getvalue()
+        try:
+            loop = asyncio.get_running_loop()
+            output = await loop.run_in_executor(self.infer_executor, self._transform_image_sync, processed_data, params)
+            processed_data['last_output'] = (signature, output)
+            return output
 
         except Exception as e:
             raise ValueError(f"Failed to modify image: {str(e)}")
+
+    @torch.inference_mode()
+    def _transform_image_sync(self, processed_data: Dict[str, Any], params: Dict[str, float]) -> bytes:
+        """
+        Render the source image of processed_data with the given params.
+
+        This is the whole GPU pipeline of transform_image(), it runs on the inference thread.
+
+        Args:
+            processed_data (Dict[str, Any]): The processed data of the source image.
+            params (Dict[str, float]): The modification params.
+
+        Returns:
+            bytes: The encoded image.
+        """
+        # Apply modifications and rotation based on params
+        x_d_new = self._transform_keypoints(processed_data, params)
+
+        # Apply stitching and generate the output
+        out = self._stitch_warp_decode(processed_data, x_d_new)
+
+        ####################################################
+        # this part is about stitching the image back into the original.
+        #
+        # this is an expensive operation, not just because of the compute
+        # but because the payload will also be bigger (we send back the whole pic)
+        #
+        # I'm currently running some experiments to do it in the frontend
+        #
+        #  --- old way: we do it in the server-side: ---
+        # the paste back is done on the GPU, so that the frame never leaves the device before encoding
+        I_p_to_ori_blend = paste_back_torch(
+            out, processed_data['crop_info']['M_c2o'], processed_data['rgb_ori'], processed_data['mask_ori'],
+            theta=processed_data['paste_back_theta']
+        )
+
+        # --- maybe future way: do it in the frontend: ---
+        #I_p_to_ori_blend = (out[0].clamp(0, 1) * 255).to(torch.uint8)
+        ####################################################
+
+        return self._encode_image(I_p_to_ori_blend)
+
+    def _stitch_warp_decode(self, processed_data: Dict[str, Any], x_d_new: torch.Tensor) -> torch.Tensor:
+        """
+        Stitch the driving keypoints, then warp and decode the source features of an image with them.
+
+        When CUDA graphs are available, the first call for an image records the whole sequence
+        into a graph, and the following calls just replay it with the new keypoints.
+
+        Args:
+            processed_data (Dict[str, Any]): The processed data of the source image.
+            x_d_new (torch.Tensor): The driving keypoints, before stitching.
+
+        Returns:
+            torch.Tensor: The 1x3xHxW decoded image, in 0~1. When it comes from a graph, it is
+            overwritten by the next replay of any graph (they share their memory pool), which is
+            fine as long as it is consumed on the inference thread.
+        """
+        if self.use_cuda_graphs and 'decode_graph' not in processed_data:
+            try:
+                processed_data['decode_graph'] = self._capture_stitch_warp_decode(processed_data, x_d_new)
+            except Exception as e:
+                logger.warning(f"Failed to capture stitching and warp_decode as a CUDA graph, running them eagerly: {str(e)}")
+                self.use_cuda_graphs = False
+
+        if not self.use_cuda_graphs:
+            return self._run_stitch_warp_decode(processed_data['f_s'], processed_data['x_s'], x_d_new)
+
+        graph, x_d_static, out_static = processed_data['decode_graph']
+        x_d_static.copy_(x_d_new)
+        graph.replay()
+        return out_static
+
+    def _run_stitch_warp_decode(self, f_s: torch.Tensor, x_s: torch.Tensor, x_d: torch.Tensor) -> torch.Tensor:
+        wrapper = self.live_portrait.live_portrait_wrapper
+        return wrapper.warp_decode(f_s, x_s, wrapper.stitching(x_s, x_d))['out']
+
+    def _capture_stitch_warp_decode(self, processed_data: Dict[str, Any], x_d_new: torch.Tensor):
+        """
+        Record stitching and warp_decode for an image into a CUDA graph.
+
+        f_s and x_s never change for a given image, so only the driving keypoints need a static buffer.
+
+        Returns:
+            Tuple[torch.cuda.CUDAGraph, torch.Tensor, torch.Tensor]: The graph, its driving keypoints input and its output.
+        """
+        f_s, x_s = processed_data['f_s'], processed_data['x_s']
+        x_d_static = x_d_new.clone()
+
+        # warm up on a side stream before capturing, as recommended by PyTorch
+        stream = torch.cuda.Stream()
+        stream.wait_stream(torch.cuda.current_stream())
+        with torch.cuda.stream(stream):
+            self._run_stitch_warp_decode(f_s, x_s, x_d_static)
+        torch.cuda.current_stream().wait_stream(stream)
+
+        # autocast must not reuse casts cached outside of the graph
+        graph = torch.cuda.CUDAGraph()
+        with torch.autocast(device_type='cuda', enabled=False, cache_enabled=False):
+            with torch.cuda.graph(graph, pool=self.graph_pool, capture_error_mode='thread_local'):
+                out_static = self._run_stitch_warp_decode(f_s, x_s, x_d_static)
+
+        return graph, x_d_static, out_static
+
+    def _encode_image(self, image: torch.Tensor) -> bytes:
+        """
+        Encode an image tensor, on the GPU (nvJPEG) whenever torchvision supports it.
+
+        Args:
+            image (torch.Tensor): The 3xHxW uint8 image.
+
+        Returns:
+            bytes: The encoded image (JPEG, or WebP when falling back to OpenCV).
+        """
+        if self.gpu_encoding:
+            try:
+                return torchvision.io.encode_jpeg(image, quality=self.encode_quality).cpu().numpy().tobytes()
+            except Exception as e:
+                # older versions of torchvision can only encode tensors living on the CPU
+                logger.warning(f"GPU encoding is not available, falling back to OpenCV: {str(e)}")
+                self.gpu_encoding = False
+
+        # the frame is laid out as contiguous HxWx3 BGR before leaving the device,
+        # so that the host copy is the only one and libwebp can read it as is
+        image_bgr = image.permute(1, 2, 0).flip(2).contiguous().cpu().numpy()
+        ok, buffer = cv2.imencode(".webp", image_bgr, [cv2.IMWRITE_WEBP_QUALITY, self.encode_quality])
+        if not ok:
+            raise ValueError("Failed to encode the image as WebP")
+        return buffer.tobytes()
@@ -24,6 +24,7 @@ class InferenceConfig(PrintableConfig):
     checkpoint_S = os.path.join(MODELS_DIR, "liveportrait", "stitching_retargeting_module.pth")
 
     flag_use_half_precision: bool = True  # whether to use half precision
+    half_precision_dtype: Literal['float16', 'bfloat16'] = 'float16'  # the dtype used for half precision by F, W and G (the motion extractor always uses float16)
 
     flag_lip_zero: bool = True  # whether let the lip to close state before animation, only take effect when flag_eye_retargeting and flag_lip_retargeting is False
     lip_zero_threshold: float = 0.03
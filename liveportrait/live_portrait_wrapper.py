@@ -5,9 +5,12 @@ Wrapper for LivePortrait core functions
 """
 
 import os.path as osp
+from concurrent.futures import ThreadPoolExecutor
+from typing import Union
 import numpy as np
 import cv2
 import torch
+import torch.nn.functional as F
 import yaml
 
 from .utils.timer import Timer
@@ -24,24 +27,32 @@ class LivePortraitWrapper(object):
 
         model_config = yaml.load(open(cfg.models_config, 'r'), Loader=yaml.SafeLoader)
 
-        # init F
-        self.appearance_feature_extractor = load_model(cfg.checkpoint_F, model_config, cfg.device_id, 'appearance_feature_extractor')
+        # the checkpoints are independent, so they are loaded in parallel (deserialization and upload release the GIL)
+        with ThreadPoolExecutor() as executor:
+            # init F
+            appearance_feature_extractor = executor.submit(load_model, cfg.checkpoint_F, model_config, cfg.device_id, 'appearance_feature_extractor')
+            # init M
+            motion_extractor = executor.submit(load_model, cfg.checkpoint_M, model_config, cfg.device_id, 'motion_extractor')
+            # init W
+            warping_module = executor.submit(load_model, cfg.checkpoint_W, model_config, cfg.device_id, 'warping_module')
+            # init G
+            spade_generator = executor.submit(load_model, cfg.checkpoint_G, model_config, cfg.device_id, 'spade_generator')
+            # init S and R
+            if cfg.checkpoint_S is not None and osp.exists(cfg.checkpoint_S):
+                stitching_retargeting_module = executor.submit(load_model, cfg.checkpoint_S, model_config, cfg.device_id, 'stitching_retargeting_module')
+            else:
+                stitching_retargeting_module = None
+
+        self.appearance_feature_extractor = appearance_feature_extractor.result()
         #log(f'Load appearance_feature_extractor done.')
-        # init M
-        self.motion_extractor = load_model(cfg.checkpoint_M, model_config, cfg.device_id, 'motion_extractor')
+        self.motion_extractor = motion_extractor.result()
         #log(f'Load motion_extractor done.')
-        # init W
-        self.warping_module = load_model(cfg.checkpoint_W, model_config, cfg.device_id, 'warping_module')
+        self.warping_module = warping_module.result()
         #log(f'Load warping_module done.')
-        # init G
-        self.spade_generator = load_model(cfg.checkpoint_G, model_config, cfg.device_id, 'spade_generator')
+        self.spade_generator = spade_generator.result()
         #log(f'Load spade_generator done.')
-        # init S and R
-        if cfg.checkpoint_S is not None and osp.exists(cfg.checkpoint_S):
-            self.stitching_retargeting_module = load_model(cfg.checkpoint_S, model_config, cfg.device_id, 'stitching_retargeting_module')
-            #log(f'Load stitching_retargeting_module done.')
-        else:
-            self.stitching_retargeting_module = None
+        self.stitching_retargeting_module = stitching_retargeting_module.result() if stitching_retargeting_module is not None else None
+        #log(f'Load stitching_retargeting_module done.')
 
         self.cfg = cfg
         self.device_id = cfg.device_id
@@ -52,10 +63,24 @@ class LivePortraitWrapper(object):
             if hasattr(self.cfg, k):
                 setattr(self.cfg, k, v)
 
-    def prepare_source(self, img: np.ndarray) -> torch.Tensor:
+    def autocast(self, dtype=None):
+        """ the context used to run the networks in half precision
+        dtype: the name of the half precision dtype, cfg.half_precision_dtype by default
+        """
+        dtype = getattr(torch, dtype or self.cfg.half_precision_dtype)
+        return torch.autocast(device_type='cuda', dtype=dtype, enabled=self.cfg.flag_use_half_precision)
+
+    def prepare_source(self, img: Union[np.ndarray, torch.Tensor]) -> torch.Tensor:
         """ construct the input as standard
         img: HxWx3, uint8, 256x256
+        or 1x3xHxW, float, normalized to 0~1 (as returned by the cropper when given a device)
         """
+        if isinstance(img, torch.Tensor):
+            x = img
+            if x.shape[-2:] != (self.cfg.input_shape[1], self.cfg.input_shape[0]):
+                x = F.interpolate(x, size=(self.cfg.input_shape[1], self.cfg.input_shape[0]), mode='area')
+            return x.clamp(0, 1).cuda(self.device_id)
+
         h, w = img.shape[:2]
         if h != self.cfg.input_shape[0] or w != self.cfg.input_shape[1]:
             x = cv2.resize(img, (self.cfg.input_shape[0], self.cfg.input_shape[1]))
@@ -96,7 +121,7 @@ class LivePortraitWrapper(object):
         x: Bx3xHxW, normalized to 0~1
         """
         with torch.no_grad():
-            with torch.autocast(device_type='cuda', dtype=torch.float16, enabled=self.cfg.flag_use_half_precision):
+            with self.autocast():
                 feature_3d = self.appearance_feature_extractor(x)
 
         return feature_3d.float()
@@ -108,7 +133,8 @@ class LivePortraitWrapper(object):
         return: A dict contains keys: 'pitch', 'yaw', 'roll', 't', 'exp', 'scale', 'kp'
         """
         with torch.no_grad():
-            with torch.autocast(device_type='cuda', dtype=torch.float16, enabled=self.cfg.flag_use_half_precision):
+            # the keypoints and the head pose need the mantissa of float16, bfloat16 is too coarse for them
+            with self.autocast('float16'):
                 kp_info = self.motion_extractor(x)
 
             if self.cfg.flag_use_half_precision:
@@ -254,7 +280,7 @@ class LivePortraitWrapper(object):
         """
         # The line 18 in Algorithm 1: D(W(f_s; x_s, x′_d,i)）
         with torch.no_grad():
-            with torch.autocast(device_type='cuda', dtype=torch.float16, enabled=self.cfg.flag_use_half_precision):
+            with self.autocast():
                 # get decoder input
                 ret_dct = self.warping_module(feature_3d, kp_source=kp_source, kp_driving=kp_driving)
                 # decode
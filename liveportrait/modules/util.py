@@ -39,9 +39,9 @@ def kp2gaussian(kp, spatial_size, kp_variance):
 
 def make_coordinate_grid(spatial_size, ref, **kwargs):
     d, h, w = spatial_size
-    x = torch.arange(w).type(ref.dtype).to(ref.device)
-    y = torch.arange(h).type(ref.dtype).to(ref.device)
-    z = torch.arange(d).type(ref.dtype).to(ref.device)
+    x = torch.arange(w, dtype=ref.dtype, device=ref.device)
+    y = torch.arange(h, dtype=ref.dtype, device=ref.device)
+    z = torch.arange(d, dtype=ref.dtype, device=ref.device)
 
     # NOTE: must be right-down-in
     x = (2 * (x / (w - 1)) - 1)  # the x axis faces to the right
@@ -28,44 +28,37 @@ def headpose_pred_to_degree(pred):
     return pred
 
 
-def get_rotation_matrix(pitch_, yaw_, roll_):
+@torch.jit.script
+def get_rotation_matrix(pitch_: torch.Tensor, yaw_: torch.Tensor, roll_: torch.Tensor) -> torch.Tensor:
     """ the input is in degree
     """
     # calculate the rotation matrix: vps @ rot
+    # scripted, and built without any host tensor, so that it stays a few fused ops on the device of the angles
 
     # transform to radian
-    pitch = pitch_ / 180 * PI
-    yaw = yaw_ / 180 * PI
-    roll = roll_ / 180 * PI
-
-    device = pitch.device
-
-    if pitch.ndim == 1:
-        pitch = pitch.unsqueeze(1)
-    if yaw.ndim == 1:
-        yaw = yaw.unsqueeze(1)
-    if roll.ndim == 1:
-        roll = roll.unsqueeze(1)
+    pitch = (pitch_ / 180 * PI).reshape(-1)
+    yaw = (yaw_ / 180 * PI).reshape(-1)
+    roll = (roll_ / 180 * PI).reshape(-1)
 
     # calculate the euler matrix
     bs = pitch.shape[0]
-    ones = torch.ones([bs, 1]).to(device)
-    zeros = torch.zeros([bs, 1]).to(device)
+    ones = torch.ones_like(pitch)
+    zeros = torch.zeros_like(pitch)
     x, y, z = pitch, yaw, roll
 
-    rot_x = torch.cat([
+    rot_x = torch.stack([
         ones, zeros, zeros,
         zeros, torch.cos(x), -torch.sin(x),
         zeros, torch.sin(x), torch.cos(x)
     ], dim=1).reshape([bs, 3, 3])
 
-    rot_y = torch.cat([
+    rot_y = torch.stack([
         torch.cos(y), zeros, torch.sin(y),
         zeros, ones, zeros,
         -torch.sin(y), zeros, torch.cos(y)
     ], dim=1).reshape([bs, 3, 3])
 
-    rot_z = torch.cat([
+    rot_z = torch.stack([
         torch.cos(z), -torch.sin(z), zeros,
         torch.sin(z), torch.cos(z), zeros,
         zeros, zeros, ones
@@ -7,6 +7,8 @@ cropping function and the related preprocess functions for cropping
 import numpy as np
 import os.path as osp
 from math import sin, cos, acos, degrees
+import torch
+import torch.nn.functional as F
 import cv2; cv2.setNumThreads(0); cv2.ocl.setUseOpenCL(False) # NOTE: enforce single thread
 from .rprint import rprint as print
 
@@ -33,6 +35,43 @@ def _transform_img(img, M, dsize, flags=CV2_INTERP, borderMode=None):
         return cv2.warpAffine(img, M[:2, :], dsize=_dsize, flags=flags)
 
 
+def get_affine_theta(M, ssize, dsize):
+    """ the affine_grid theta equivalent to cv2.warpAffine with M
+    M: 2x3 matrix or 3x3 matrix, same convention as cv2.warpAffine
+    ssize: source shape (width, height)
+    dsize: target shape (width, height)
+    return: 1x2x3 float32 ndarray
+    """
+    w_src, h_src = ssize
+    w_dst, h_dst = dsize
+
+    # cv2.warpAffine samples the source at M^-1 @ (x, y, 1) for each target pixel (x, y),
+    # grid_sample expects the same mapping in normalized [-1, 1] coordinates (align_corners=False)
+    M_inv = np.linalg.inv(np.vstack([M[:2, :], np.array([0, 0, 1], dtype=M.dtype)]))
+    norm_src = np.array([[2 / w_src, 0, 1 / w_src - 1], [0, 2 / h_src, 1 / h_src - 1], [0, 0, 1]])
+    denorm_dst = np.array([[w_dst / 2, 0, (w_dst - 1) / 2], [0, h_dst / 2, (h_dst - 1) / 2], [0, 0, 1]])
+    return (norm_src @ M_inv @ denorm_dst)[None, :2].astype(np.float32)
+
+
+def _transform_img_torch(img, M, dsize, theta=None):
+    """ torch counterpart of _transform_img, the warp runs on the device of img
+    img: BxCxHxW float tensor
+    M: 2x3 matrix or 3x3 matrix, same convention as cv2.warpAffine
+    dsize: target shape (width, height)
+    theta: the 1x2x3 tensor from get_affine_theta, computed from M when not given
+    """
+    h_src, w_src = img.shape[-2:]
+    w_dst, h_dst = dsize
+
+    if theta is None:
+        theta = torch.from_numpy(get_affine_theta(M, (w_src, h_src), dsize)).to(img.device)
+
+    bs, c = img.shape[:2]
+    theta = theta.to(img.dtype).expand(bs, 2, 3)
+    grid = F.affine_grid(theta, [bs, c, h_dst, w_dst], align_corners=False)
+    return F.grid_sample(img, grid, mode='bilinear', padding_mode='zeros', align_corners=False)
+
+
 def _transform_pts(pts, M):
     """ conduct similarity or affine transformation to the pts
     pts: Nx2 ndarray
@@ -410,3 +449,16 @@ def paste_back(image_to_processed, crop_M_c2o, rgb_ori, mask_ori):
     result = _transform_img(image_to_processed, crop_M_c2o, dsize=dsize)
     result = np.clip(mask_ori * result + (1 - mask_ori) * rgb_ori, 0, 255).astype(np.uint8)
     return result
+
+def paste_back_torch(image_to_processed, crop_M_c2o, rgb_ori, mask_ori, theta=None):
+    """paste back the image, without leaving the device of the tensors
+    image_to_processed: 1x3xhxw, float, 0~1
+    rgb_ori: 1x3xHxW, uint8 or float, 0~255
+    mask_ori: 1x1xHxW or 1x3xHxW, float (any precision), 0~1
+    theta: optional 1x2x3 tensor from get_affine_theta(crop_M_c2o, (w, h), (W, H)), on the device of the tensors
+    return: 3xHxW, uint8
+    """
+    dsize = (rgb_ori.shape[-1], rgb_ori.shape[-2])
+    result = _transform_img_torch(image_to_processed.clamp(0, 1) * 255, crop_M_c2o, dsize=dsize, theta=theta)
+    result = torch.lerp(rgb_ori.to(result.dtype), result, mask_ori.to(result.dtype)).clamp_(0, 255).to(torch.uint8)
+    return result[0]
@@ -7,8 +7,10 @@ import os.path as osp
 from typing import List, Union, Tuple
 from dataclasses import dataclass, field
 import cv2; cv2.setNumThreads(0); cv2.ocl.setUseOpenCL(False)
+import torch
+import torch.nn.functional as F
 
-from .landmark_runner import LandmarkRunner
+from .landmark_runner import LandmarkRunner, CUDA_PROVIDER_OPTIONS, make_session_options
 from .face_analysis_diy import FaceAnalysisDIY
 from .helper import prefix
 from .crop import crop_image, crop_image_by_bbox, parse_bbox_from_landmark, average_bbox_lst
@@ -49,7 +51,8 @@ class Cropper(object):
         self.face_analysis_wrapper = FaceAnalysisDIY(
             name='buffalo_l',
             root=make_abs_path(os.path.join(MODELS_DIR, "insightface")),
-            providers=["CUDAExecutionProvider"]
+            providers=[("CUDAExecutionProvider", {'device_id': device_id, **CUDA_PROVIDER_OPTIONS})],
+            sess_options=make_session_options()
         )
         self.face_analysis_wrapper.prepare(ctx_id=device_id, det_size=(512, 512))
         self.face_analysis_wrapper.warmup()
@@ -95,7 +98,13 @@ class Cropper(object):
             vy_ratio=kwargs.get('vy_ratio', -0.15),
         )
         # update a 256x256 version for network input or else
-        ret_dct['img_crop_256x256'] = cv2.resize(ret_dct['img_crop'], (256, 256), interpolation=cv2.INTER_AREA)
+        device = kwargs.get('device', None)
+        if device is not None:
+            # downscale on the device, the result is directly the 1x3x256x256 network input, normalized to 0~1
+            img_crop = torch.from_numpy(ret_dct['img_crop']).to(device).permute(2, 0, 1).unsqueeze(0).float() / 255.
+            ret_dct['img_crop_256x256'] = F.interpolate(img_crop, size=(256, 256), mode='area')
+        else:
+            ret_dct['img_crop_256x256'] = cv2.resize(ret_dct['img_crop'], (256, 256), interpolation=cv2.INTER_AREA)
         ret_dct['pt_crop_256x256'] = ret_dct['pt_crop'] * 256 / kwargs.get('dsize', 512)
 
         recon_ret = self.landmark_runner.run(img_rgb, pts)
@@ -8,6 +8,7 @@ import os
 import os.path as osp
 import torch
 from collections import OrderedDict
+from safetensors.torch import load_file
 
 from ..modules.spade_generator import SPADEDecoder
 from ..modules.warping_network import WarpingNetwork
@@ -90,6 +91,17 @@ def remove_ddp_dumplicate_key(state_dict):
     return state_dict_new
 
 
+def load_checkpoint(ckpt_path):
+    """ load a state dict without unpickling a copy of the whole file:
+    a .safetensors sibling of the checkpoint is preferred when it exists, otherwise the .pth is memory-mapped
+    """
+    safetensors_path = osp.splitext(ckpt_path)[0] + '.safetensors'
+    if osp.exists(safetensors_path):
+        return load_file(safetensors_path)
+
+    return torch.load(ckpt_path, weights_only=True, mmap=True, map_location=lambda storage, loc: storage)
+
+
 def load_model(ckpt_path, model_config, device, model_type):
     model_params = model_config['model_params'][f'{model_type}_params']
 
@@ -104,7 +116,7 @@ def load_model(ckpt_path, model_config, device, model_type):
     elif model_type == 'stitching_retargeting_module':
         # Special handling for stitching and retargeting module
         config = model_config['model_params']['stitching_retargeting_module_params']
-        checkpoint = torch.load(ckpt_path, weights_only=True, map_location=lambda storage, loc: storage)
+        checkpoint = torch.load(ckpt_path, weights_only=True, mmap=True, map_location=lambda storage, loc: storage)
 
         stitcher = StitchingRetargetingNetwork(**config.get('stitching'))
         stitcher.load_state_dict(remove_ddp_dumplicate_key(checkpoint['retarget_shoulder']))
@@ -129,7 +141,7 @@ def load_model(ckpt_path, model_config, device, model_type):
     else:
         raise ValueError(f"Unknown model type: {model_type}")
 
-    model.load_state_dict(torch.load(ckpt_path, weights_only=True, map_location=lambda storage, loc: storage))
+    model.load_state_dict(load_checkpoint(ckpt_path))
     model.eval()
     return model
 
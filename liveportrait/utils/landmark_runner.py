@@ -23,6 +23,19 @@ def to_ndarray(obj):
         return np.array(obj)
 
 
+# the input shapes never change, so the best cuDNN convolution algorithms are searched once, during the warmup
+CUDA_PROVIDER_OPTIONS = {'cudnn_conv_algo_search': 'EXHAUSTIVE'}
+
+
+def make_session_options():
+    """session options with every graph optimization (constant folding, conv+bn+relu fusions...)"""
+    opts = onnxruntime.SessionOptions()
+    opts.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+    opts.execution_mode = onnxruntime.ExecutionMode.ORT_SEQUENTIAL
+    opts.enable_mem_pattern = True
+    return opts
+
+
 class LandmarkRunner(object):
     """landmark runner"""
     def __init__(self, **kwargs):
@@ -35,11 +48,12 @@ class LandmarkRunner(object):
         if onnx_provider.lower() == 'cuda':
             self.session = onnxruntime.InferenceSession(
                 ckpt_path, providers=[
-                    ('CUDAExecutionProvider', {'device_id': device_id})
-                ]
+                    ('CUDAExecutionProvider', {'device_id': device_id, **CUDA_PROVIDER_OPTIONS})
+                ],
+                sess_options=make_session_options()
             )
         else:
-            opts = onnxruntime.SessionOptions()
+            opts = make_session_options()
             opts.intra_op_num_threads = 4  # 默认线程数为 4
             self.session = onnxruntime.InferenceSession(
                 ckpt_path, providers=['CPUExecutionProvider'],
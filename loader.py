@@ -4,7 +4,6 @@ import torch
 import asyncio
 import aiohttp
 import requests
-from huggingface_hub import hf_hub_download
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -17,6 +16,14 @@ DEVICE = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
 # Hugging Face repository information
 HF_REPO_ID = "jbilcke-hf/model-cocktail"
+HF_TOKEN = os.environ.get('HF_TOKEN')
+
+# Models are streamed to disk by chunks, with a few downloads at a time
+DOWNLOAD_CHUNK_SIZE = 1 << 20
+MAX_CONCURRENT_DOWNLOADS = 8
+
+# Large files can take as long as they need, but a stalled connection must not hang the startup
+DOWNLOAD_TIMEOUT = aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=60)
 
 # Model files to download
 MODEL_FILES = [
@@ -57,6 +64,10 @@ MODEL_FILES = [
     #"pulid-flux/pulid_v1.bin"
 ]
 
+# Where each model file goes, and the directories to create for them (computed once)
+MODEL_DESTS = {filename: os.path.join(MODELS_DIR, filename) for filename in MODEL_FILES}
+MODEL_DIRS = {os.path.dirname(dest) for dest in MODEL_DESTS.values()}
+
 def create_directory(directory):
     """Create a directory if it doesn't exist and log its status."""
     if not os.path.exists(directory):
@@ -75,38 +86,44 @@ def print_directory_structure(startpath):
         for f in files:
             logger.info(f"{subindent}{f}")
 
-async def download_hf_file(filename: str) -> None:
+async def download_hf_file(session: aiohttp.ClientSession, semaphore: asyncio.Semaphore, filename: str) -> None:
     """Download a file from Hugging Face to the models directory."""
-    dest = os.path.join(MODELS_DIR, filename)
-    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    dest = MODEL_DESTS[filename]
     if os.path.exists(dest):
         # this is really for debugging purposes only
         logger.debug(f"    ✅ {filename}")
         return
 
-    logger.info(f"    ⏳ Downloading {HF_REPO_ID}/{filename}")
+    url = f"https://huggingface.co/{HF_REPO_ID}/resolve/main/{filename}"
+    tmp_dest = f"{dest}.tmp"
 
-    try:
-        await asyncio.get_event_loop().run_in_executor(
-            None,
-            lambda: hf_hub_download(
-                repo_id=HF_REPO_ID,
-                filename=filename,
-                local_dir=MODELS_DIR
-            )
-        )
-        logger.info(f"    ✅ Downloaded {filename}")
-    except Exception as e:
-        logger.error(f"🚨 Error downloading file from Hugging Face: {e}")
-        if os.path.exists(dest):
-            os.remove(dest)
-        raise
+    async with semaphore:
+        logger.info(f"    ⏳ Downloading {HF_REPO_ID}/{filename}")
+
+        try:
+            async with session.get(url) as response:
+                response.raise_for_status()
+                with open(tmp_dest, "wb") as f:
+                    async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                        f.write(chunk)
+
+            # the file only appears under its final name once it is complete
+            os.replace(tmp_dest, dest)
+            logger.info(f"    ✅ Downloaded {filename}")
+        except Exception as e:
+            logger.error(f"🚨 Error downloading file from Hugging Face: {e}")
+            if os.path.exists(tmp_dest):
+                os.remove(tmp_dest)
+            raise
 
 async def download_all_models():
     """Download all required models from the Hugging Face repository."""
     logger.info("  🔎 Looking for models...")
-    tasks = [download_hf_file(filename) for filename in MODEL_FILES]
-    await asyncio.gather(*tasks)
+    headers = {"Authorization": f"Bearer {HF_TOKEN}"} if HF_TOKEN else None
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_DOWNLOADS)
+    async with aiohttp.ClientSession(headers=headers, timeout=DOWNLOAD_TIMEOUT) as session:
+        tasks = [download_hf_file(session, semaphore, filename) for filename in MODEL_FILES]
+        await asyncio.gather(*tasks)
     logger.info("  ✅ All models are available")
 
     # are you looking to debug the app and verify that models are downloaded properly?
@@ -137,6 +154,9 @@ class ModelLoader:
                 flag_pasteback=True,  # whether to paste-back/stitch the animated face cropping from the face-cropping space to the original image space
                 flag_do_crop= True,  # whether to crop the source portrait to the face-cropping space
                 flag_do_rot=True,  # whether to conduct the rotation when flag_do_crop is True
+                # bfloat16 keeps the range of float32, so we prefer it on the GPUs supporting it natively (Ampere and newer),
+                # older ones only emulate it, without the tensor cores that fp16 convolutions get
+                half_precision_dtype='bfloat16' if self.device.type == 'cuda' and torch.cuda.get_device_capability()[0] >= 8 else 'float16',
             ),
             crop_cfg=CropConfig()
         )
@@ -162,4 +182,6 @@ async def initialize_models():
 # Initial setup
 logger.info("🚀 Setting up storage directories...")
 create_directory(MODELS_DIR)
+for model_dir in MODEL_DIRS:
+    os.makedirs(model_dir, exist_ok=True)
 logger.info("✅ Storage directories setup completed.")
@@ -25261,6 +25261,22 @@ function truncateFileName(fileName, maxLength = 16) {
   const end = fileName.slice(-maxLength / 2 + 2);
   return `${start}...${end}`;
 }
+async function getImageExtension(blob) {
+  switch (blob.type) {
+    case "image/jpeg":
+      return "jpg";
+    case "image/png":
+      return "png";
+    case "image/webp":
+      return "webp";
+  }
+  const bytes = new Uint8Array(await blob.slice(0, 12).arrayBuffer());
+  if (bytes[0] === 255 && bytes[1] === 216)
+    return "jpg";
+  if (bytes[0] === 137 && bytes[1] === 80 && bytes[2] === 78 && bytes[3] === 71)
+    return "png";
+  return "webp";
+}
 
 // src/components/ui/alert.tsx
 var jsx_dev_runtime = __toESM(require_jsx_dev_runtime(), 1);
@@ -29844,10 +29860,7 @@ class FacePoke {
     this.emitEvent("cleanup");
   }
   async loadImage(image) {
-    const base64Data = image.split(",")[1] || image;
-    const buffer = new Uint8Array(atob(base64Data).split("").map((char) => char.charCodeAt(0)));
-    const blob = new Blob([buffer], { type: "application/octet-binary" });
-    this.sendBlobMessage(await blob.arrayBuffer());
+    this.sendBlobMessage(await image.arrayBuffer());
   }
   transformImage(uuid, params) {
     this.sendJsonMessage({ uuid, params });
@@ -30026,7 +30039,7 @@ var useMainStore = create((set, get) => ({
         previewImage: image,
         originalImage: image
       });
-      facePoke.loadImage(image);
+      facePoke.loadImage(file);
     } catch (err) {
       console.log(`failed to load the image: `, err);
       set({
@@ -30039,7 +30052,13 @@ var useMainStore = create((set, get) => ({
   setIsGazingAtCursor: (isGazingAtCursor) => set({ isGazingAtCursor }),
   setOriginalImage: (url) => set({ originalImage: url }),
   setOriginalImageUuid: (originalImageUuid) => set({ originalImageUuid }),
-  setPreviewImage: (url) => set({ previewImage: url }),
+  setPreviewImage: (url) => {
+    const { previewImage } = get();
+    if (previewImage !== url && previewImage.startsWith("blob:")) {
+      URL.revokeObjectURL(previewImage);
+    }
+    set({ previewImage: url });
+  },
   resetImage: () => {
     const { originalImage } = get();
     if (originalImage) {
@@ -30067,7 +30086,7 @@ var useMainStore = create((set, get) => ({
       setPreviewImage(originalImage);
       setOriginalImageUuid("");
     } else if (typeof params.image !== "undefined") {
-      const image = await convertImageToBase64(params.image);
+      const image = URL.createObjectURL(params.image);
       setPreviewImage(image);
     } else if (typeof params.loaded !== "undefined") {
       setOriginalImageUuid(params.loaded.u);
@@ -33546,11 +33565,12 @@ function App() {
     const files = event.target.files;
     setImageFile(files?.[0] || undefined);
   }, [setImageFile]);
-  const handleDownload = import_react10.useCallback(() => {
+  const handleDownload = import_react10.useCallback(async () => {
     if (previewImage) {
+      const blob = await fetch(previewImage).then((res) => res.blob());
       const link = document.createElement("a");
       link.href = previewImage;
-      link.download = "result.webp";
+      link.download = `result.${await getImageExtension(blob)}`;
       document.body.appendChild(link);
       link.click();
       document.body.removeChild(link);
@@ -0,0 +1,98 @@
+"""
+Check the caching of the uploaded images: hash dedupe, shared loads and paired eviction.
+"""
+
+import asyncio
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("cv2")
+
+import engine as engine_module
+from engine import Engine, IMAGE_CACHE_SIZE, get_image_hash
+
+
+def make_engine(monkeypatch, load_image_sync=None):
+    """ an engine without any model, whose image loading is stubbed """
+    engine = Engine.__new__(Engine)
+    engine.image_cache = OrderedDict()
+    engine.processed_cache = {}
+    engine.loading_images = {}
+
+    engine.load_calls = 0
+
+    def _load_image_sync(data, image_hash):
+        engine.load_calls += 1
+        return {'image_hash': image_hash, 'crop_info': {'lmk_crop': None}}
+
+    engine._load_image_sync = load_image_sync or _load_image_sync
+
+    monkeypatch.setattr(engine_module, "parse_bbox_from_landmark", lambda lmk, **kwargs: {
+        'center': np.zeros(2), 'size': 1.0, 'bbox': np.zeros((4, 2)), 'angle': 0.0,
+    })
+    return engine
+
+
+def test_concurrent_uploads_share_one_uid(monkeypatch):
+    engine = make_engine(monkeypatch)
+
+    async def run():
+        return await asyncio.gather(*(engine.load_image(b"same image") for _ in range(4)))
+
+    results = asyncio.run(run())
+
+    assert len({result['u'] for result in results}) == 1
+    assert engine.load_calls == 1
+    assert list(engine.processed_cache) == [results[0]['u']]
+    assert not engine.loading_images
+
+
+def test_eviction_drops_processed_data(monkeypatch):
+    engine = make_engine(monkeypatch)
+
+    async def run():
+        return [await engine.load_image(f"image {i}".encode()) for i in range(IMAGE_CACHE_SIZE + 1)]
+
+    results = asyncio.run(run())
+    evicted_uid = results[0]['u']
+
+    assert len(engine.image_cache) == IMAGE_CACHE_SIZE
+    assert len(engine.processed_cache) == IMAGE_CACHE_SIZE
+    assert get_image_hash(b"image 0") not in engine.image_cache
+    assert evicted_uid not in engine.processed_cache
+
+    with pytest.raises(ValueError, match="cache miss"):
+        asyncio.run(engine.transform_image(evicted_uid, {}))
+
+
+def test_cancelled_caller_keeps_the_shared_load(monkeypatch):
+    release = threading.Event()
+
+    def _load_image_sync(data, image_hash):
+        release.wait(timeout=10)
+        return {'image_hash': image_hash, 'crop_info': {'lmk_crop': None}}
+
+    engine = make_engine(monkeypatch, _load_image_sync)
+
+    async def run():
+        first = asyncio.ensure_future(engine.load_image(b"same image"))
+        second = asyncio.ensure_future(engine.load_image(b"same image"))
+        await asyncio.sleep(0)
+
+        # the first client goes away while the image is still loading
+        first.cancel()
+        await asyncio.sleep(0)
+        release.set()
+
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    result = asyncio.run(run())
+
+    assert result['u'] in engine.processed_cache
+    assert engine.image_cache[get_image_hash(b"same image")] is result
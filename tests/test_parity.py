@@ -0,0 +1,123 @@
+"""
+Check the vectorized keypoints transform and the GPU paste back against the original implementations.
+"""
+
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("cv2")
+
+from engine import Engine, transform_keypoints
+from liveportrait.utils.crop import get_affine_theta, paste_back, paste_back_torch, prepare_paste_back
+
+
+def baseline_transform_keypoints(kp, params, R, scale, t):
+    """ the per-element loop that transform_keypoints() replaces """
+    x_d_new = kp.clone()
+
+    modifications = [
+        ('smile', [
+            (0, 20, 1, -0.01), (0, 14, 1, -0.02), (0, 17, 1, 0.0065), (0, 17, 2, 0.003),
+            (0, 13, 1, -0.00275), (0, 16, 1, -0.00275), (0, 3, 1, -0.0035), (0, 7, 1, -0.0035)
+        ]),
+        ('aaa', [
+            (0, 19, 1, 0.001), (0, 19, 2, 0.0001), (0, 17, 1, -0.0001)
+        ]),
+        ('eee', [
+            (0, 20, 2, -0.001), (0, 20, 1, -0.001), (0, 14, 1, -0.001)
+        ]),
+        ('woo', [
+            (0, 14, 1, 0.001), (0, 3, 1, -0.0005), (0, 7, 1, -0.0005), (0, 17, 2, -0.0005)
+        ]),
+        ('wink', [
+            (0, 11, 1, 0.001), (0, 13, 1, -0.0003), (0, 17, 0, 0.0003),
+            (0, 17, 1, 0.0003), (0, 3, 1, -0.0003)
+        ]),
+        ('pupil_x', [
+            (0, 11, 0, 0.0007 if params.get('pupil_x', 0) > 0 else 0.001),
+            (0, 15, 0, 0.001 if params.get('pupil_x', 0) > 0 else 0.0007)
+        ]),
+        ('pupil_y', [
+            (0, 11, 1, -0.001), (0, 15, 1, -0.001)
+        ]),
+        ('eyes', [
+            (0, 11, 1, -0.001), (0, 13, 1, 0.0003), (0, 15, 1, -0.001), (0, 16, 1, 0.0003),
+            (0, 1, 1, -0.00025), (0, 2, 1, 0.00025)
+        ]),
+        ('eyebrow', [
+            (0, 1, 1, 0.001 if params.get('eyebrow', 0) > 0 else 0.0003),
+            (0, 2, 1, -0.001 if params.get('eyebrow', 0) > 0 else -0.0003),
+            (0, 1, 0, -0.001 if params.get('eyebrow', 0) <= 0 else 0),
+            (0, 2, 0, 0.001 if params.get('eyebrow', 0) <= 0 else 0)
+        ]),
+    ]
+
+    for param_name, adjustments in modifications:
+        param_value = params.get(param_name, 0)
+        for i, j, k, factor in adjustments:
+            x_d_new[i, j, k] += param_value * factor
+
+    # Special case for pupil_y affecting eyes
+    x_d_new[0, 11, 1] -= params.get('pupil_y', 0) * 0.001
+    x_d_new[0, 15, 1] -= params.get('pupil_y', 0) * 0.001
+
+    return scale * (x_d_new @ R) + t
+
+
+@pytest.mark.parametrize("value", [1.5, 0.0, -1.5])
+def test_transform_keypoints_matches_baseline(value):
+    # only the tensors built by _init_facial_modifications() are needed
+    engine = SimpleNamespace(device=torch.device("cpu"))
+    Engine._init_facial_modifications(engine)
+
+    generator = torch.Generator().manual_seed(0)
+    kp = torch.randn(1, 21, 3, generator=generator)
+    R = torch.linalg.qr(torch.randn(3, 3, generator=generator))[0][None]
+    scale = torch.tensor([[1.3]])
+    t = torch.randn(1, 3, generator=generator)
+
+    params = {name: value for name in engine._param_names}
+    p = torch.tensor([params[name] for name in engine._param_names])
+
+    expected = baseline_transform_keypoints(kp, params, R, scale, t)
+    actual = transform_keypoints(kp, p, engine._mod_deltas, R, scale, t)
+    torch.testing.assert_close(actual, expected, rtol=1e-5, atol=1e-6)
+
+
+def test_paste_back_torch_matches_paste_back():
+    rng = np.random.default_rng(0)
+    h, w = 64, 64
+    H, W = 120, 160
+
+    # smooth crop and mask, so that the fixed point interpolation of cv2 stays within rounding
+    ys, xs = np.mgrid[0:h, 0:w].astype(np.float32)
+    crop = np.stack([xs * 3, ys * 3, (xs + ys) * 1.5], axis=-1).round().astype(np.uint8)
+    radius = np.hypot(xs - w / 2, ys - h / 2) / (w / 2)
+    mask_crop = np.repeat((np.clip(1.2 - radius, 0, 1) * 255).astype(np.uint8)[..., None], 3, axis=-1)
+    rgb_ori = rng.integers(0, 256, (H, W, 3), dtype=np.uint8)
+
+    # the crop is scaled up, rotated and moved into the original image
+    angle = np.deg2rad(10)
+    s = 1.4
+    M_c2o = np.array([
+        [s * np.cos(angle), -s * np.sin(angle), 50],
+        [s * np.sin(angle), s * np.cos(angle), 15],
+        [0, 0, 1],
+    ], dtype=np.float32)
+
+    mask_ori = prepare_paste_back(mask_crop, M_c2o, dsize=(W, H))
+    expected = paste_back(crop, M_c2o, rgb_ori, mask_ori)
+
+    theta = torch.from_numpy(get_affine_theta(M_c2o, (w, h), (W, H)))
+    actual = paste_back_torch(
+        torch.from_numpy(crop).permute(2, 0, 1)[None].float() / 255,
+        M_c2o,
+        torch.from_numpy(rgb_ori).permute(2, 0, 1)[None],
+        torch.from_numpy(np.ascontiguousarray(mask_ori[:, :, 0]))[None, None],
+        theta=theta,
+    ).permute(1, 2, 0).numpy()
+
+    assert np.abs(actual.astype(np.int16) - expected.astype(np.int16)).max() <= 1